@@ -0,0 +1,410 @@
+"""
+Streaming assembler for large card packets (audit cards, Hold/OSD tags).
+Run: python card_packet.py --template "<card>.pdf" --count 5000 --qr-url "http://<host>:8000/card/{n}"
+
+Unlike serve_demo.add_qr_to_pdf, pages are written to disk as they are added
+instead of being accumulated in a PdfWriter. The template's fonts, images and
+content are written once as a shared Form XObject; each page is only a small
+content stream that draws it (plus an optional per-card QR code), so memory
+stays flat and the output stays small no matter how many cards are printed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import zlib
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+
+# Requires PyPDF2 >= 3.0 (snake_case API: get_contents, mediabox, rotation).
+try:
+    import qrcode
+    from PyPDF2 import PdfReader
+    from PyPDF2.generic import (
+        ArrayObject,
+        DictionaryObject,
+        IndirectObject,
+        NameObject,
+        NumberObject,
+        PdfObject,
+        RectangleObject,
+        StreamObject,
+    )
+except ImportError as exc:  # pragma: no cover - import guard
+    raise SystemExit("Missing deps. Install with: pip install 'qrcode[pil]' 'PyPDF2>=3.0'") from exc
+
+ROOT = Path(__file__).resolve().parent
+OUTPUT_DIR = ROOT.parent.parent / "output"
+
+# Pages per intermediate /Pages node; only one node's kids are held in memory.
+PAGES_PER_NODE = 256
+
+# QR placement matches serve_demo.add_qr_to_pdf (1 inch, bottom-right).
+QR_SIZE = 72
+QR_MARGIN = 36
+QR_X_OFFSET = 54
+
+# Filters PyPDF2 decodes completely; such streams are re-encoded as FlateDecode.
+GENERIC_FILTERS = {"/FlateDecode", "/Fl", "/LZWDecode", "/LZW", "/ASCIIHexDecode", "/AHx", "/ASCII85Decode", "/A85"}
+# Image codecs PyPDF2 passes through untouched; they may only end a filter chain.
+PASSTHROUGH_FILTERS = {"/DCTDecode", "/JPXDecode"}
+
+
+class _TemplatePage(NamedTuple):
+    form: int
+    mediabox: RectangleObject
+    cropbox: Optional[RectangleObject]
+    rotation: int
+
+
+class CardPacketWriter:
+    """Write a multi-page card packet incrementally from a PDF template.
+
+    Every template page is imported once as a Form XObject; ``add_card`` then
+    emits one page referencing it. Only the xref offsets (8 bytes per object)
+    and the current page-tree node are kept in memory between pages.
+
+    The template's /MediaBox, /CropBox and /Rotate are carried onto each page,
+    but its /Annots (links, form fields) are dropped. Output goes to a
+    ``.part`` file that only replaces ``output_path`` once ``close`` succeeds;
+    leaving the ``with`` block on an exception deletes it instead.
+    """
+
+    def __init__(self, output_path: Path, template_path: Path) -> None:
+        reader = PdfReader(str(template_path))
+        if reader.is_encrypted:
+            raise ValueError(f"Encrypted templates are not supported: {template_path}")
+
+        self._output_path = output_path
+        self._part_path = output_path.with_name(output_path.name + ".part")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._stream: BinaryIO = open(self._part_path, "wb")
+        self._offsets = array("Q", [0])  # object 0 is the free-list head
+
+        self._catalog = self._reserve()
+        self._root_pages = self._reserve()
+        self._root_kids: List[int] = []
+        self._node: Optional[int] = None
+        self._node_kids: List[int] = []
+        self._page_count = 0
+
+        # The reader and its parsed objects are released once the import is done.
+        self._templates: List[_TemplatePage] = []
+        try:
+            self._stream.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            imported: Dict[Tuple[int, int], int] = {}
+            for page in reader.pages:
+                self._templates.append(_TemplatePage(
+                    form=self._import_page(page, imported),
+                    mediabox=page.mediabox,
+                    cropbox=page.cropbox if "/CropBox" in page else None,
+                    rotation=page.rotation % 360,
+                ))
+        except BaseException:
+            self.abort()
+            raise
+
+    @property
+    def page_count(self) -> int:
+        return self._page_count
+
+    @property
+    def template_pages(self) -> int:
+        return len(self._templates)
+
+    def add_card(self, template_page: int = 0, qr_data: Optional[str] = None) -> None:
+        """Append one page drawing ``template_page``, optionally with a QR code."""
+        template = self._templates[template_page]
+        mediabox = template.mediabox
+        width = float(mediabox.width)
+        x0, y0 = float(mediabox.left), float(mediabox.bottom)
+
+        xobjects = DictionaryObject({NameObject("/Tpl"): IndirectObject(template.form, 0, None)})
+        content = b"q /Tpl Do Q\n"
+        if qr_data is not None:
+            xobjects[NameObject("/QR")] = IndirectObject(self._write_qr_image(qr_data), 0, None)
+            qr_x = x0 + width - QR_SIZE - QR_MARGIN - QR_X_OFFSET
+            qr_y = y0 + QR_MARGIN
+            content += f"q {QR_SIZE} 0 0 {QR_SIZE} {qr_x:g} {qr_y:g} cm /QR Do Q\n".encode()
+
+        contents = self._write_flate(DictionaryObject(), content)
+
+        if self._node is None:
+            self._node = self._reserve()
+        page = DictionaryObject({
+            NameObject("/Type"): NameObject("/Page"),
+            NameObject("/Parent"): IndirectObject(self._node, 0, None),
+            NameObject("/MediaBox"): mediabox,
+            NameObject("/Resources"): DictionaryObject({NameObject("/XObject"): xobjects}),
+            NameObject("/Contents"): IndirectObject(contents, 0, None),
+        })
+        if template.cropbox is not None:
+            page[NameObject("/CropBox")] = template.cropbox
+        if template.rotation:
+            page[NameObject("/Rotate")] = NumberObject(template.rotation)
+        self._node_kids.append(self._write(page))
+        self._page_count += 1
+        if len(self._node_kids) >= PAGES_PER_NODE:
+            self._flush_node()
+
+    def close(self) -> None:
+        """Write the page tree, catalog, xref table and trailer, then publish the file."""
+        if self._stream.closed:
+            return
+        self._flush_node()
+        self._write(DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(IndirectObject(n, 0, None) for n in self._root_kids),
+            NameObject("/Count"): NumberObject(self._page_count),
+        }), self._root_pages)
+        self._write(DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self._root_pages, 0, None),
+        }), self._catalog)
+
+        xref_offset = self._stream.tell()
+        self._stream.write(f"xref\n0 {len(self._offsets)}\n".encode())
+        self._stream.write(b"0000000000 65535 f \n")
+        for offset in self._offsets[1:]:
+            self._stream.write(f"{offset:010d} 00000 n \n".encode())
+        self._stream.write(
+            f"trailer\n<< /Size {len(self._offsets)} /Root {self._catalog} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+        self._stream.close()
+        self._part_path.replace(self._output_path)
+
+    def abort(self) -> None:
+        """Discard the partial packet without touching ``output_path``."""
+        self._stream.close()
+        self._part_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "CardPacketWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _reserve(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _write(self, obj: PdfObject, num: Optional[int] = None, data: Optional[bytes] = None) -> int:
+        """Write ``obj`` as object ``num``; with ``data`` it is a stream's dictionary."""
+        if num is None:
+            num = self._reserve()
+        if data is not None:
+            obj[NameObject("/Length")] = NumberObject(len(data))
+        self._offsets[num] = self._stream.tell()
+        self._stream.write(f"{num} 0 obj\n".encode())
+        obj.write_to_stream(self._stream, None)
+        if data is not None:
+            self._stream.write(b"\nstream\n")
+            self._stream.write(data)
+            self._stream.write(b"\nendstream")
+        self._stream.write(b"\nendobj\n")
+        return num
+
+    def _write_flate(self, entries: DictionaryObject, data: bytes, num: Optional[int] = None) -> int:
+        entries[NameObject("/Filter")] = NameObject("/FlateDecode")
+        return self._write(entries, num, zlib.compress(data))
+
+    def _flush_node(self) -> None:
+        if self._node is None:
+            return
+        self._write(DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Parent"): IndirectObject(self._root_pages, 0, None),
+            NameObject("/Kids"): ArrayObject(IndirectObject(n, 0, None) for n in self._node_kids),
+            NameObject("/Count"): NumberObject(len(self._node_kids)),
+        }), self._node)
+        self._root_kids.append(self._node)
+        self._node = None
+        self._node_kids = []
+
+    def _import_page(self, page, imported: Dict[Tuple[int, int], int]) -> int:
+        """Write a template page as a Form XObject and return its object number."""
+        contents = page.get_contents()
+        form = DictionaryObject({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): page.mediabox,
+        })
+        if "/Resources" in page:
+            form[NameObject("/Resources")] = self._import(page["/Resources"], imported)
+        if "/Group" in page:
+            form[NameObject("/Group")] = self._import(page["/Group"], imported)
+        if contents is None:
+            data = b""
+        elif isinstance(contents, ArrayObject):
+            # PyPDF2 3.0 returns multi-stream /Contents as the raw array.
+            data = b"\n".join(part.get_object().get_data() for part in contents)
+        else:
+            data = contents.get_data()
+        return self._write_flate(form, data)
+
+    def _import(self, obj: PdfObject, imported: Dict[Tuple[int, int], int]) -> PdfObject:
+        """Copy ``obj`` from the template, writing each indirect object once.
+
+        Objects shared between template pages (fonts, images, graphics states)
+        are looked up in ``imported`` so they are only ever written one time.
+        """
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in imported:
+                num = imported[key] = self._reserve()
+                target = obj.get_object()
+                if isinstance(target, StreamObject):
+                    self._import_stream(target, imported, num)
+                else:
+                    self._write(self._import(target, imported), num)
+            return IndirectObject(imported[key], 0, None)
+        if isinstance(obj, StreamObject):
+            raise ValueError("Template has a direct stream object; streams must be indirect")
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({k: self._import(v, imported) for k, v in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._import(v, imported) for v in obj)
+        return obj
+
+    def _import_stream(self, stream: StreamObject, imported: Dict[Tuple[int, int], int], num: int) -> None:
+        """Copy a template stream through its decoded data.
+
+        Generic filters are decoded and the data re-compressed as FlateDecode;
+        a trailing JPEG/JPEG 2000 codec is kept, since PyPDF2 returns those
+        bytes still encoded. Anything else (CCITT, JBIG2, ...) is rejected.
+        """
+        filters = stream.get("/Filter", ArrayObject())
+        if isinstance(filters, IndirectObject):
+            filters = filters.get_object()
+        if isinstance(filters, NameObject):
+            filters = ArrayObject([filters])
+        codec = filters[-1] if filters and filters[-1] in PASSTHROUGH_FILTERS else None
+        unsupported = [f for f in filters[:-1 if codec else None] if f not in GENERIC_FILTERS]
+        if unsupported:
+            raise ValueError(f"Unsupported template stream filter(s): {', '.join(unsupported)}")
+
+        entries = DictionaryObject({
+            k: self._import(v, imported)
+            for k, v in stream.items()
+            if k not in ("/Length", "/Filter", "/DecodeParms")
+        })
+        data = stream.get_data()
+        if codec is None:
+            self._write_flate(entries, data, num)
+            return
+        entries[NameObject("/Filter")] = codec
+        if len(filters) == 1 and "/DecodeParms" in stream:
+            entries[NameObject("/DecodeParms")] = self._import(stream["/DecodeParms"], imported)
+        self._write(entries, num, data)
+
+    def _write_qr_image(self, data: str) -> int:
+        """Write ``data`` as a 1-bit QR image XObject, one pixel per module."""
+        qr = qrcode.QRCode(
+            version=None,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            border=2,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+        matrix = qr.get_matrix()
+        size = len(matrix)
+
+        rows = bytearray()
+        for row in matrix:
+            bits = 0
+            for col, dark in enumerate(row):
+                bits = (bits << 1) | (0 if dark else 1)  # DeviceGray: 1 = white
+                if col % 8 == 7:
+                    rows.append(bits)
+                    bits = 0
+            if size % 8:
+                rows.append(bits << (8 - size % 8))
+
+        image = DictionaryObject({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(size),
+            NameObject("/Height"): NumberObject(size),
+            NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+            NameObject("/BitsPerComponent"): NumberObject(1),
+        })
+        return self._write_flate(image, bytes(rows))
+
+
+def build_packet(
+    template_path: Path,
+    output_path: Path,
+    count: int,
+    qr_url: Optional[str] = None,
+) -> int:
+    """Write ``count`` copies of every template page; ``{n}`` in ``qr_url`` is the card number."""
+    with CardPacketWriter(output_path, template_path) as writer:
+        pages = writer.template_pages
+        for n in range(1, count + 1):
+            for index in range(pages):
+                # Like serve_demo, the QR code goes on the card's last page.
+                qr_data = qr_url.format(n=n) if qr_url and index == pages - 1 else None
+                writer.add_card(index, qr_data)
+        return writer.page_count
+
+
+def self_test(template_path: Path = OUTPUT_DIR / "Hold OSD Quarantine Card.pdf") -> None:
+    """Build a multi-node packet and check it with a strict reader."""
+    count = PAGES_PER_NODE * 2 + 1
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = Path(tmp) / "packet.pdf"
+        pages = count * len(PdfReader(str(template_path)).pages)
+        assert build_packet(template_path, output_path, count, "http://test/card/{n}") == pages
+
+        reader = PdfReader(str(output_path), strict=True)
+        assert len(reader.pages) == pages, len(reader.pages)
+        xobjects = [page["/Resources"]["/XObject"] for page in reader.pages]
+        forms = {x.raw_get("/Tpl").idnum for x in xobjects}
+        assert len(forms) == pages // count, f"expected one shared /Tpl per template page, got {len(forms)}"
+        qr_images = {x.raw_get("/QR").idnum for x in xobjects if "/QR" in x}
+        assert len(qr_images) == count, "expected one QR image per card"
+
+        # A failed build must not leave a (valid-looking) packet behind.
+        try:
+            with CardPacketWriter(output_path, template_path) as writer:
+                writer.add_card()
+                raise RuntimeError("simulated failure")
+        except RuntimeError:
+            pass
+        assert output_path.exists(), "a failed build must not touch the previous packet"
+        assert len(PdfReader(str(output_path)).pages) == pages
+        assert not list(Path(tmp).glob("*.part")), "partial packet was left behind"
+    print(f"Self-test passed ({pages} pages, {len(reader.trailer['/Root']['/Pages']['/Kids'])} page-tree nodes)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Assemble a large card packet PDF with bounded memory")
+    parser.add_argument("--template", type=Path, help="Card PDF to repeat")
+    parser.add_argument("--count", type=int, help="Number of cards in the packet")
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR / "card_packet.pdf", help="Output PDF (default: output/card_packet.pdf)")
+    parser.add_argument("--qr-url", help="Optional per-card QR URL; {n} is replaced with the card number")
+    parser.add_argument("--self-test", action="store_true", help="Build a sample packet from output/ and verify it, then exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test(args.template or OUTPUT_DIR / "Hold OSD Quarantine Card.pdf")
+        return
+    if args.template is None or args.count is None:
+        parser.error("--template and --count are required")
+    if not args.template.exists():
+        raise FileNotFoundError(f"Missing PDF at {args.template}")
+    if args.count < 1:
+        raise SystemExit("--count must be at least 1")
+
+    pages = build_packet(args.template, args.output, args.count, args.qr_url)
+    print(f"Wrote {pages} pages to {args.output}")
+
+
+if __name__ == "__main__":
+    main()